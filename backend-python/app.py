@@ -1,22 +1,85 @@
-from fastapi import FastAPI, HTTPException, Header, Request
+from fastapi import FastAPI, HTTPException, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional
+from contextlib import asynccontextmanager
+from collections import deque
+from decimal import Decimal
 import httpx
-import json
+import orjson
 from google.oauth2 import id_token as google_id_token
 from google.auth.transport import requests as google_requests
 from pydantic import BaseModel
+import asyncio
+import bisect
+import hashlib
+import itertools
 import os
+import secrets
+import threading
 import time
-import uuid
+from cachetools import TTLCache
 try:
     import boto3
+    from boto3.dynamodb.conditions import Key
     from botocore.exceptions import BotoCoreError, ClientError
 except Exception:
     boto3 = None
 
-app = FastAPI()
+# Configuration is read once at import; none of these change while the process runs.
+DDB_TABLE = os.getenv("DDB_TABLE")
+RISK_SERVICE_URL = os.getenv("RISK_SERVICE_URL", "http://localhost:8080/risk")
+GOOGLE_OAUTH_CLIENT_ID = os.getenv("GOOGLE_OAUTH_CLIENT_ID")
+GOOGLE_PROJECT_ID = os.getenv("GOOGLE_PROJECT_ID")
+ALLOW_CLEAR = os.getenv("ALLOW_CLEAR", "false").lower() in ("1", "true", "yes")
+# Always ask the risk service, even when the local tiers already decide the outcome.
+RISK_REMOTE_ALWAYS = os.getenv("RISK_REMOTE_ALWAYS", "false").lower() in ("1", "true", "yes")
+# Configurable local heuristic fallback
+try:
+    HIGH_RISK_AMOUNT = int(os.getenv("HIGH_RISK_AMOUNT", "10000"))
+except ValueError:
+    HIGH_RISK_AMOUNT = 10000
+
+
+def make_ddb_table():
+    """Build the DynamoDB Table handle once, or return None to use the in-memory store."""
+    if not (boto3 and DDB_TABLE):
+        return None
+    try:
+        return boto3.resource("dynamodb").Table(DDB_TABLE)
+    except (BotoCoreError, ClientError) as e:
+        print(f"DynamoDB setup failed: {e}")
+        return None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One long-lived client for the risk service so connections are pooled and kept alive
+    # across requests instead of paying a fresh TCP handshake on every transaction.
+    # http2=True only takes effect for https:// risk URLs (negotiated via TLS ALPN); the
+    # plain-http Go service used in docker-compose stays on pooled HTTP/1.1 connections.
+    app.state.http_client = httpx.AsyncClient(
+        http2=True,
+        timeout=httpx.Timeout(5.0, connect=1.0),
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=100, keepalive_expiry=30),
+    )
+    # boto3 resource/table setup parses service models, so do it once per process.
+    app.state.ddb_table = make_ddb_table()
+    # Records are queued and written in batches by a background flusher.
+    app.state.ddb_queue = None
+    flusher = None
+    if app.state.ddb_table is not None:
+        app.state.ddb_queue = asyncio.Queue()
+        flusher = asyncio.create_task(ddb_flusher(app.state.ddb_table, app.state.ddb_queue))
+    try:
+        yield
+    finally:
+        if flusher is not None:
+            await stop_ddb_flusher(flusher, app.state.ddb_table, app.state.ddb_queue)
+        await app.state.http_client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Development CORS: allow the Vite dev server and localhost
 app.add_middleware(
@@ -36,6 +99,25 @@ app.add_middleware(
 )
 
 
+# Amount tiers: LOW (<= 1000), MEDIUM (<= 10000), HIGH (> 10000).
+# bisect_left keeps the upper bound of each tier inclusive.
+_THRESHOLDS = (1000, 10000)
+_LABELS = ("LOW", "MEDIUM", "HIGH")
+
+
+def amount_tier(amount: float) -> str:
+    """Local risk tier for an amount, matching the risk service's default rules."""
+    return _LABELS[bisect.bisect_left(_THRESHOLDS, amount)]
+
+
+# Whether a risk level reported by the service flags the transaction.
+_HIGH_RISK_BY_LEVEL = {"HIGH": True, "MEDIUM": False, "LOW": False}
+# Amounts in (low, high] may be reclassified by the risk service's merchant rules
+# (e.g. the coffee-shop anomaly above $500); outside it the service always agrees
+# with the local tiers, so the network call is skipped.
+RISK_REMOTE_BAND = (500, 10000)
+
+
 class Transaction(BaseModel):
     amount: float
     currency: str
@@ -44,120 +126,254 @@ class Transaction(BaseModel):
     risk_level: Optional[str] = None
 
 
-# In-memory fallback store (used if DynamoDB not configured)
-transactions_store: list[dict] = []
+# Verified Google ID token payloads, keyed by a SHA-256 of the raw token so we don't
+# repeat the RSA signature check (and possible certs fetch) for every request.
+# Verification runs in worker threads, so cache access is guarded by a lock.
+_token_cache: TTLCache = TTLCache(maxsize=1024, ttl=300)
+_token_cache_lock = threading.Lock()
 
 
-def save_transaction_record(record: dict):
-    """Save transaction to DynamoDB if configured, otherwise append to in-memory store."""
-    table_name = os.getenv("DDB_TABLE")
-    if boto3 and table_name:
-        try:
-            dynamo = boto3.resource("dynamodb")
-            table = dynamo.Table(table_name)
-            table.put_item(Item=record)
-            return True
-        except (BotoCoreError, ClientError) as e:
-            print(f"DynamoDB save failed: {e}")
+def _verify_google(token: str, audience: Optional[str]) -> dict:
+    """Verify a Google ID token, reusing a cached payload while the token is still valid."""
+    key = hashlib.sha256(token.encode()).hexdigest()
+    with _token_cache_lock:
+        payload = _token_cache.get(key)
+    if payload and payload.get("exp", 0) > time.time() + 5:
+        return payload
+    google_request = google_requests.Request()
+    payload = google_id_token.verify_oauth2_token(token, google_request, audience) if audience else google_id_token.verify_oauth2_token(token, google_request)
+    with _token_cache_lock:
+        _token_cache[key] = payload
+    return payload
+
+
+# DynamoDB global secondary indexes used to read recent transactions newest-first.
+# Both use `timestamp` as the sort key; the feed index is partitioned on a constant
+# `feed` attribute written with every item so unfiltered reads can Query instead of Scan.
+NAME_INDEX = "name-timestamp-index"
+EMAIL_INDEX = "email-timestamp-index"
+FEED_INDEX = "feed-timestamp-index"
+FEED_PARTITION = "ALL"
+
+
+# In-memory fallback store (used if DynamoDB not configured).
+# Newest records sit on the left; maxlen drops the oldest from the right in O(1).
+transactions_store: deque = deque(maxlen=200)
+
+
+# BatchWriteItem accepts at most 25 items; wait briefly to fill a batch under load.
+DDB_BATCH_SIZE = 25
+DDB_FLUSH_INTERVAL = 0.01
+
+
+def save_transaction_record(queue: Optional[asyncio.Queue], record: dict):
+    """Queue transaction for DynamoDB if configured, otherwise append to in-memory store."""
+    if queue is not None:
+        queue.put_nowait(record)
+        return True
     # fallback
-    transactions_store.insert(0, record)
-    # keep store size reasonable
-    if len(transactions_store) > 200:
-        transactions_store.pop()
+    transactions_store.appendleft(record)
     return False
 
 
-@app.post("/transactions")
-async def create_transaction(transaction: Transaction, x_user: Optional[str] = Header(None), authorization: Optional[str] = Header(None)):
-    # Support Google ID tokens sent as `Authorization: Bearer <id_token>`.
-    user_header = None
-    if authorization and authorization.startswith("Bearer "):
-        token = authorization.split(" ", 1)[1]
+def _ddb_item(record: dict) -> dict:
+    # boto3 rejects Python floats; DynamoDB numbers must be Decimal
+    return {**record, "amount": Decimal(str(record["amount"])), "feed": FEED_PARTITION}
+
+
+def _put_batch(table, batch: list[dict]):
+    with table.batch_writer() as writer:
+        for record in batch:
+            writer.put_item(Item=_ddb_item(record))
+
+
+async def write_ddb_batch(table, batch: list[dict]):
+    """Write a batch with BatchWriteItem.
+
+    If the batch fails, each record is retried on its own so one bad item can't take
+    the rest down with it; only records that still fail go to the in-memory store.
+    """
+    try:
+        await asyncio.to_thread(_put_batch, table, batch)
+        return
+    except Exception as e:
+        # Catch everything: an escaping error would kill the flusher and drop every later record.
+        print(f"DynamoDB batch save failed, retrying items individually: {e}")
+    for record in batch:
         try:
-            # Optionally validate audience if provided in env
-            audience = os.getenv("GOOGLE_OAUTH_CLIENT_ID")
-            request = google_requests.Request()
-            payload = google_id_token.verify_oauth2_token(token, request, audience) if audience else google_id_token.verify_oauth2_token(token, request)
-            # payload contains email and name
-            user_header = json.dumps({"name": payload.get("name"), "email": payload.get("email")})
+            await asyncio.to_thread(table.put_item, Item=_ddb_item(record))
         except Exception as e:
-            print(f"Google token verification failed: {e}")
-            raise HTTPException(status_code=401, detail="Invalid Google ID token")
-    elif x_user:
-        user_header = x_user
+            print(f"DynamoDB save failed for {record.get('id')}: {e}")
+            transactions_store.appendleft(record)
 
-    if not user_header:
-        raise HTTPException(status_code=401, detail="Missing authentication. Provide Authorization Bearer token or X-User header.")
-    risk_data = {}
-    RISK_SERVICE_URL = os.getenv("RISK_SERVICE_URL", "http://localhost:8080/risk")
+
+# Queued by stop_ddb_flusher to tell the flusher to write what it has and exit.
+_FLUSHER_STOP = None
+
+
+async def ddb_flusher(table, queue: asyncio.Queue):
+    """Drain queued records into DynamoDB, up to DDB_BATCH_SIZE items or DDB_FLUSH_INTERVAL at a time.
+
+    Runs until it reads the stop sentinel; records queued ahead of it are always written.
+    """
+    while True:
+        record = await queue.get()
+        if record is _FLUSHER_STOP:
+            return
+        batch = [record]
+        # give a burst a moment to accumulate unless a full batch is already waiting
+        if queue.qsize() < DDB_BATCH_SIZE - 1:
+            await asyncio.sleep(DDB_FLUSH_INTERVAL)
+        stop = False
+        while len(batch) < DDB_BATCH_SIZE and not queue.empty():
+            record = queue.get_nowait()
+            if record is _FLUSHER_STOP:
+                stop = True
+                break
+            batch.append(record)
+        await write_ddb_batch(table, batch)
+        if stop:
+            return
+
+
+async def stop_ddb_flusher(flusher: asyncio.Task, table, queue: asyncio.Queue):
+    """Stop the flusher after it has written everything queued so far."""
+    queue.put_nowait(_FLUSHER_STOP)
     try:
-        async with httpx.AsyncClient() as client:
-            risk_response = await client.post(
-                RISK_SERVICE_URL,
-                json={"amount": transaction.amount, "merchant": transaction.merchant},
-                timeout=5.0,
-            )
-            # prefer JSON, but guard against malformed replies
-            try:
-                risk_data = risk_response.json()
-            except Exception:
-                risk_data = {}
+        await flusher
+    except Exception as e:
+        print(f"DynamoDB flusher failed: {e}")
+    # if the flusher died early, write whatever it left behind
+    pending = []
+    while not queue.empty():
+        record = queue.get_nowait()
+        if record is not _FLUSHER_STOP:
+            pending.append(record)
+    if pending:
+        await write_ddb_batch(table, pending)
+
+
+# user_name/user_email are GSI partition keys: they must be strings, and DynamoDB caps
+# key values at 2048 bytes. Keep well under that.
+MAX_USER_FIELD_BYTES = 256
+
+
+def _user_field(value) -> Optional[str]:
+    """Return value if it is usable as a user_name/user_email key, otherwise None."""
+    if isinstance(value, str) and value and len(value.encode()) <= MAX_USER_FIELD_BYTES:
+        return value
+    return None
+
+
+def parse_user(header: str) -> dict:
+    """Split an X-User header into name and email.
+
+    The frontend sends JSON like {"name": ..., "email": ...}; any other value is taken as the name.
+    Fields that are not short strings are treated as missing.
+    """
+    try:
+        j = orjson.loads(header)
+    except orjson.JSONDecodeError:
+        j = None
+    if isinstance(j, dict):
+        return {"name": _user_field(j.get("name")), "email": _user_field(j.get("email"))}
+    return {"name": _user_field(header), "email": None}
+
+
+async def fetch_risk(client: httpx.AsyncClient, transaction: Transaction) -> dict:
+    """Ask the risk service to classify a transaction; returns {} if it can't be reached."""
+    try:
+        risk_response = await client.post(
+            RISK_SERVICE_URL,
+            json={"amount": transaction.amount, "merchant": transaction.merchant},
+        )
+        # prefer JSON, but guard against malformed replies
+        try:
+            return risk_response.json()
+        except Exception:
+            return {}
     except Exception as e:
         # In dev/demo, don't fail the whole request when risk service is unavailable.
         # Log and continue with a safe default (not flagged) — we'll apply a local heuristic below.
         print(f"Risk service error: {e}")
-        risk_data = {}
+        return {}
 
-    # Configurable local heuristic fallback
-    try:
-        HIGH_RISK_AMOUNT = int(os.getenv("HIGH_RISK_AMOUNT", "10000"))
-    except Exception:
-        HIGH_RISK_AMOUNT = 10000
 
-    is_high = False
-    risk_level = (risk_data.get("risk_level") if isinstance(risk_data, dict) else None)
+async def assess_risk(client: httpx.AsyncClient, transaction: Transaction) -> dict:
+    """Classify locally when the amount tier is decisive, otherwise defer to the risk service."""
+    if not RISK_REMOTE_ALWAYS and not (RISK_REMOTE_BAND[0] < transaction.amount <= RISK_REMOTE_BAND[1]):
+        return {"risk_level": amount_tier(transaction.amount)}
+    return await fetch_risk(client, transaction)
 
-    if risk_level == "HIGH":
-        is_high = True
-    elif risk_level == "MEDIUM":
-        is_high = False
-    elif risk_level == "LOW":
-        is_high = False
+
+@app.post("/transactions")
+async def create_transaction(transaction: Transaction, request: Request, x_user: Optional[str] = Header(None), authorization: Optional[str] = Header(None)):
+    # Support Google ID tokens sent as `Authorization: Bearer <id_token>`.
+    token = None
+    if authorization and len(authorization) > 7 and authorization[:7].lower() == "bearer ":
+        token = authorization[7:].strip()
+    elif not x_user:
+        raise HTTPException(status_code=401, detail="Missing authentication. Provide Authorization Bearer token or X-User header.")
+    else:
+        user_obj = parse_user(x_user)
+        if not (user_obj["name"] or user_obj["email"]):
+            raise HTTPException(status_code=400, detail="Invalid X-User header.")
+
+    risk_call = assess_risk(request.app.state.http_client, transaction)
+    if token is not None:
+        # Token verification is independent of the risk lookup, so run them concurrently.
+        # google-auth is synchronous; verify in a worker thread to keep the loop free.
+        payload, risk_data = await asyncio.gather(
+            asyncio.to_thread(_verify_google, token, GOOGLE_OAUTH_CLIENT_ID),
+            risk_call,
+            return_exceptions=True,
+        )
+        if isinstance(payload, Exception):
+            print(f"Google token verification failed: {payload}")
+            raise HTTPException(status_code=401, detail="Invalid Google ID token")
+        # payload contains email and name
+        user_obj = {"name": _user_field(payload.get("name")), "email": _user_field(payload.get("email"))}
     else:
+        risk_data = await risk_call
+
+    if isinstance(risk_data, Exception):
+        print(f"Risk service error: {risk_data}")
+        risk_data = {}
+
+    risk_level = (risk_data.get("risk_level") if isinstance(risk_data, dict) else None)
+
+    is_high = _HIGH_RISK_BY_LEVEL.get(risk_level)
+    if is_high is None:
         # fallback rule: large amounts are high risk
-        if transaction.amount >= HIGH_RISK_AMOUNT:
-            is_high = True
+        is_high = transaction.amount >= HIGH_RISK_AMOUNT
+        # Derive risk_level from amount tiers if service didn't provide one
+        risk_level = amount_tier(transaction.amount)
 
     transaction.high_risk = bool(is_high)
-
     # Ensure we return a risk_level string for the frontend to display
-    if risk_level in ("HIGH", "MEDIUM", "LOW"):
-        transaction.risk_level = risk_level
-    else:
-        # Derive risk_level from amount tiers if service didn't provide one
-        if transaction.amount > 10000:
-            transaction.risk_level = "HIGH"
-        elif transaction.amount > 1000:
-            transaction.risk_level = "MEDIUM"
-        else:
-            transaction.risk_level = "LOW"
+    transaction.risk_level = risk_level
 
     # Build record with timestamp and id
     record = {
-        "id": str(uuid.uuid4()),
+        # time-prefixed id: sorts by creation time and is cheaper than uuid4
+        "id": f"{time.time_ns():016x}{secrets.token_hex(8)}",
         "timestamp": int(time.time()),
-        "user": user_header,
         "amount": float(transaction.amount),
         "currency": transaction.currency,
         "merchant": transaction.merchant,
         "risk_level": transaction.risk_level,
         "high_risk": bool(transaction.high_risk),
     }
+    # Omitted when unknown: DynamoDB rejects null values for index key attributes.
+    if user_obj["name"]:
+        record["user_name"] = user_obj["name"]
+    if user_obj["email"]:
+        record["user_email"] = user_obj["email"]
 
     # persist
-    saved_to_ddb = save_transaction_record(record)
+    saved_to_ddb = save_transaction_record(request.app.state.ddb_queue, record)
     if saved_to_ddb:
-        print("Saved transaction to DynamoDB")
+        print("Queued transaction for DynamoDB")
     else:
         print("Stored transaction in local store")
 
@@ -178,9 +394,7 @@ async def verify_id_token(body: TokenBody):
     if not token:
         raise HTTPException(status_code=400, detail="Missing id_token in body")
     try:
-        audience = os.getenv("GOOGLE_OAUTH_CLIENT_ID")
-        request = google_requests.Request()
-        payload = google_id_token.verify_oauth2_token(token, request, audience) if audience else google_id_token.verify_oauth2_token(token, request)
+        payload = _verify_google(token, GOOGLE_OAUTH_CLIENT_ID)
         return {"ok": True, "payload": payload}
     except Exception as e:
         print(f"Token verify failed: {e}")
@@ -193,59 +407,51 @@ async def auth_config():
 
     Returns JSON: { client_id, project_id }
     """
-    client_id = os.getenv("GOOGLE_OAUTH_CLIENT_ID")
-    project_id = os.getenv("GOOGLE_PROJECT_ID")
-    return {"client_id": client_id, "project_id": project_id}
+    return {"client_id": GOOGLE_OAUTH_CLIENT_ID, "project_id": GOOGLE_PROJECT_ID}
 
 
 @app.get("/transactions")
-async def list_transactions(limit: int = 20, x_user: Optional[str] = Header(None)):
+async def list_transactions(request: Request, limit: int = Query(20, ge=1), x_user: Optional[str] = Header(None)):
     """Return recent transactions from DynamoDB (if configured) or in-memory store.
 
-    If `X-User` header is provided, filter results to records matching that user string
-    or the contained email when JSON is provided.
+    If `X-User` header is provided, filter results to records matching its email,
+    or its name when the header carries no email.
     """
-    table_name = os.getenv("DDB_TABLE")
-    items = []
-    if boto3 and table_name:
+    hdr_user = parse_user(x_user) if x_user else None
+    table = request.app.state.ddb_table
+    if table is not None:
         try:
-            dynamo = boto3.resource("dynamodb")
-            table = dynamo.Table(table_name)
-            resp = table.scan(Limit=limit)
-            items = resp.get("Items", [])
-            # sort by timestamp desc
-            items = sorted(items, key=lambda x: int(x.get("timestamp", 0)), reverse=True)[:limit]
+            # Query the timestamp-sorted indexes so Limit bounds the rows returned,
+            # not the rows examined as it would with a filtered Scan.
+            if hdr_user and hdr_user["email"]:
+                index, key = EMAIL_INDEX, Key("user_email").eq(hdr_user["email"])
+            elif hdr_user and hdr_user["name"]:
+                index, key = NAME_INDEX, Key("user_name").eq(hdr_user["name"])
+            elif hdr_user:
+                # header carries no usable name or email, so nothing can match it
+                return {"items": []}
+            else:
+                index, key = FEED_INDEX, Key("feed").eq(FEED_PARTITION)
+            # boto3 is synchronous; run the query in a worker thread so the event loop stays free.
+            resp = await asyncio.to_thread(
+                table.query,
+                IndexName=index,
+                KeyConditionExpression=key,
+                ScanIndexForward=False,
+                Limit=limit,
+            )
+            return {"items": resp.get("Items", [])}
         except (BotoCoreError, ClientError) as e:
             print(f"DynamoDB fetch failed: {e}")
-            items = transactions_store[:limit]
-    else:
-        items = transactions_store[:limit]
-
-    # If x_user supplied, attempt to filter by exact user string or by email inside JSON
-    if x_user:
-        def extract_email(s: str) -> Optional[str]:
-            try:
-                import json
-                j = json.loads(s)
-                return j.get("email")
-            except Exception:
-                return None
-
-        hdr_email = extract_email(x_user)
-        filtered = []
-        for it in items:
-            u = it.get("user")
-            if not u:
-                continue
-            if u == x_user:
-                filtered.append(it)
-                continue
-            # try to match by email inside stored user (if stored as JSON string)
-            stored_email = extract_email(u) if isinstance(u, str) else None
-            if hdr_email and stored_email and hdr_email == stored_email:
-                filtered.append(it)
-                continue
-        items = filtered[:limit]
+
+    items = list(itertools.islice(transactions_store, limit))
+
+    if hdr_user and hdr_user["email"]:
+        items = [it for it in items if it.get("user_email") == hdr_user["email"]]
+    elif hdr_user and hdr_user["name"]:
+        items = [it for it in items if it.get("user_name") == hdr_user["name"]]
+    elif hdr_user:
+        items = []
 
     return {"items": items}
 
@@ -253,9 +459,7 @@ async def list_transactions(limit: int = 20, x_user: Optional[str] = Header(None
 @app.delete("/transactions")
 async def clear_transactions():
     """Clear in-memory transaction store. If DynamoDB is configured, this is disabled unless ALLOW_CLEAR env var is set."""
-    table_name = os.getenv("DDB_TABLE")
-    allow_clear = os.getenv("ALLOW_CLEAR", "false").lower() in ("1", "true", "yes")
-    if table_name and not allow_clear:
+    if DDB_TABLE and not ALLOW_CLEAR:
         raise HTTPException(status_code=403, detail="Clearing DynamoDB-backed records is disabled in this environment.")
     transactions_store.clear()
     return {"ok": True}
@@ -1,22 +1,30 @@
-from fastapi import FastAPI, Request
-from pydantic import BaseModel
+import bisect
+
+import msgspec
+import orjson
+from fastapi import FastAPI, HTTPException, Request, Response
 
 app = FastAPI()
 
+# Tiered logic: LOW (0-1000), MEDIUM (1000-10000), HIGH (>10000).
+# Mirrors the fallback tiers in app.py; bisect_left keeps each upper bound inclusive.
+_THRESHOLDS = (1000, 10000)
+_LABELS = ("LOW", "MEDIUM", "HIGH")
+# Only three possible replies, so serialize them once at import.
+_BODIES = {level: orjson.dumps({"risk_level": level}) for level in _LABELS}
+
 
-class RiskRequest(BaseModel):
+class RiskRequest(msgspec.Struct):
     amount: float
     merchant: str | None = None
 
 
 @app.post("/risk")
-async def risk(req: RiskRequest):
-    # Tiered logic: LOW (0-1000), MEDIUM (1000-10000), HIGH (>10000)
-    if req.amount > 10000:
-        level = "HIGH"
-    elif req.amount > 1000:
-        level = "MEDIUM"
-    else:
-        level = "LOW"
-
-    return {"risk_level": level}
+async def risk(request: Request):
+    # Decode with msgspec rather than a Pydantic body model; this endpoint is hit once per transaction.
+    try:
+        req = msgspec.json.decode(await request.body(), type=RiskRequest)
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    level = _LABELS[bisect.bisect_left(_THRESHOLDS, req.amount)]
+    return Response(content=_BODIES[level], media_type="application/json")
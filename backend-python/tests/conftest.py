@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+# app.py and mock_risk.py are top-level modules in backend-python/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def clear_store():
+    app.transactions_store.clear()
+    yield
+    app.transactions_store.clear()
@@ -0,0 +1,120 @@
+import asyncio
+from decimal import Decimal
+
+from boto3.dynamodb.types import TypeSerializer
+
+import app
+
+_serializer = TypeSerializer()
+
+
+def _serialize(item):
+    # same check boto3 applies before sending, e.g. rejecting Python floats
+    return {k: _serializer.serialize(v) for k, v in item.items()}
+
+
+class StubWriter:
+    """Buffers puts and sends them all on exit, like boto3's batch_writer."""
+
+    def __init__(self, table):
+        self.table = table
+        self.buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            if self.table.fail:
+                raise TypeError("Float types are not supported. Use Decimal types instead.")
+            for item in self.buffer:
+                _serialize(item)
+            self.table.items.extend(self.buffer)
+        return False
+
+    def put_item(self, Item):
+        self.buffer.append(Item)
+
+
+class StubTable:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.items = []
+        self.batches = 0
+
+    def batch_writer(self):
+        self.batches += 1
+        return StubWriter(self)
+
+    def put_item(self, Item):
+        if self.fail:
+            raise TypeError("Float types are not supported. Use Decimal types instead.")
+        _serialize(Item)
+        self.items.append(Item)
+
+
+def make_record(i):
+    return {"id": str(i), "timestamp": i, "amount": 12.5, "merchant": "m"}
+
+
+def test_flusher_batches_queued_records():
+    async def run():
+        table, queue = StubTable(), asyncio.Queue()
+        flusher = asyncio.create_task(app.ddb_flusher(table, queue))
+        for i in range(30):
+            app.save_transaction_record(queue, make_record(i))
+        await asyncio.sleep(app.DDB_FLUSH_INTERVAL * 5)
+        await app.stop_ddb_flusher(flusher, table, queue)
+        return table
+
+    table = asyncio.run(run())
+    assert len(table.items) == 30
+    assert table.batches == 2
+    assert table.items[0]["amount"] == Decimal("12.5")
+    assert table.items[0]["feed"] == app.FEED_PARTITION
+
+
+def test_failed_batch_falls_back_and_flusher_keeps_running():
+    async def run():
+        table, queue = StubTable(fail=True), asyncio.Queue()
+        flusher = asyncio.create_task(app.ddb_flusher(table, queue))
+        app.save_transaction_record(queue, make_record(1))
+        await asyncio.sleep(app.DDB_FLUSH_INTERVAL * 5)
+        alive = not flusher.done()
+        table.fail = False
+        app.save_transaction_record(queue, make_record(2))
+        await asyncio.sleep(app.DDB_FLUSH_INTERVAL * 5)
+        await app.stop_ddb_flusher(flusher, table, queue)
+        return table, alive
+
+    table, alive = asyncio.run(run())
+    assert alive
+    assert [r["id"] for r in app.transactions_store] == ["1"]
+    assert [r["id"] for r in table.items] == ["2"]
+
+
+def test_stop_writes_records_pulled_during_fill_window():
+    async def run():
+        table, queue = StubTable(), asyncio.Queue()
+        flusher = asyncio.create_task(app.ddb_flusher(table, queue))
+        app.save_transaction_record(queue, make_record(1))
+        # let the flusher take the record and start waiting for more
+        await asyncio.sleep(0)
+        await app.stop_ddb_flusher(flusher, table, queue)
+        return table, flusher
+
+    table, flusher = asyncio.run(run())
+    assert flusher.done()
+    assert [r["id"] for r in table.items] == ["1"]
+
+
+def test_poison_record_does_not_drop_the_rest_of_its_batch():
+    async def run():
+        table = StubTable()
+        poison = {**make_record("bad"), "user_name": 1.5}
+        await app.write_ddb_batch(table, [make_record("good"), poison])
+        return table
+
+    table = asyncio.run(run())
+    assert [r["id"] for r in table.items] == ["good"]
+    assert [r["id"] for r in app.transactions_store] == ["bad"]
@@ -0,0 +1,18 @@
+from fastapi.testclient import TestClient
+
+import app
+
+
+def test_list_transactions_rejects_negative_limit():
+    with TestClient(app.app) as client:
+        resp = client.get("/transactions", params={"limit": -1})
+    assert resp.status_code == 422
+
+
+def test_list_transactions_limits_in_memory_results():
+    for i in range(5):
+        app.save_transaction_record(None, {"id": str(i), "user_email": "a@example.com"})
+    with TestClient(app.app) as client:
+        resp = client.get("/transactions", params={"limit": 2})
+    assert resp.status_code == 200
+    assert [it["id"] for it in resp.json()["items"]] == ["4", "3"]
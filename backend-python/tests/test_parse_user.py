@@ -0,0 +1,48 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+
+
+def test_parse_user_reads_frontend_json():
+    assert app.parse_user('{"name": "Ada", "email": "ada@example.com"}') == {"name": "Ada", "email": "ada@example.com"}
+
+
+def test_parse_user_plain_string_is_name():
+    assert app.parse_user("ada") == {"name": "ada", "email": None}
+
+
+@pytest.mark.parametrize("value", ['{"x": 1}', "1.5", "[1]", "true"])
+def test_parse_user_non_string_fields_are_missing(value):
+    header = f'{{"name": {value}, "email": "ada@example.com"}}'
+    assert app.parse_user(header) == {"name": None, "email": "ada@example.com"}
+
+
+def test_parse_user_rejects_oversized_fields():
+    long_name = "a" * (app.MAX_USER_FIELD_BYTES + 1)
+    header = f'{{"name": "{long_name}", "email": 7}}'
+    assert app.parse_user(header) == {"name": None, "email": None}
+
+
+def test_create_transaction_rejects_unusable_x_user():
+    with TestClient(app.app) as client:
+        resp = client.post(
+            "/transactions",
+            json={"amount": 12.5, "currency": "USD", "merchant": "m"},
+            headers={"X-User": '{"name": 1.5, "email": {"x": 1}}'},
+        )
+    assert resp.status_code == 400
+    assert list(app.transactions_store) == []
+
+
+def test_create_transaction_stores_user_fields():
+    with TestClient(app.app) as client:
+        resp = client.post(
+            "/transactions",
+            json={"amount": 12.5, "currency": "USD", "merchant": "m"},
+            headers={"X-User": '{"name": "Ada", "email": "ada@example.com"}'},
+        )
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["user_name"] == "Ada"
+    assert body["user_email"] == "ada@example.com"
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+import mock_risk
+
+
+class StubResponse:
+    def json(self):
+        return {"risk_level": "REMOTE"}
+
+
+class StubClient:
+    def __init__(self):
+        self.calls = []
+
+    async def post(self, url, json):
+        self.calls.append(json)
+        return StubResponse()
+
+
+def assess(amount, merchant="Starbucks"):
+    client = StubClient()
+    txn = app.Transaction(amount=amount, currency="USD", merchant=merchant)
+    result = asyncio.run(app.assess_risk(client, txn))
+    return result, client.calls
+
+
+@pytest.mark.parametrize(
+    "amount, remote, local_level",
+    [
+        (500, False, "LOW"),
+        (500.01, True, None),
+        (10000, True, None),
+        (10000.01, False, "HIGH"),
+    ],
+)
+def test_assess_risk_only_calls_service_inside_band(amount, remote, local_level):
+    result, calls = assess(amount)
+    assert bool(calls) is remote
+    assert result == ({"risk_level": "REMOTE"} if remote else {"risk_level": local_level})
+
+
+@pytest.mark.parametrize("amount", [12.5, 500, 10000.01, 50000])
+def test_assess_risk_always_remote(monkeypatch, amount):
+    monkeypatch.setattr(app, "RISK_REMOTE_ALWAYS", True)
+    result, calls = assess(amount)
+    assert len(calls) == 1
+    assert result == {"risk_level": "REMOTE"}
+
+
+TIER_CASES = [
+    (1000, "LOW"),
+    (1000.01, "MEDIUM"),
+    (10000, "MEDIUM"),
+    (10000.01, "HIGH"),
+]
+
+
+@pytest.mark.parametrize("amount, level", TIER_CASES)
+def test_amount_tier_boundaries(amount, level):
+    assert app.amount_tier(amount) == level
+
+
+@pytest.mark.parametrize("amount, level", TIER_CASES)
+def test_mock_risk_tier_boundaries(amount, level):
+    client = TestClient(mock_risk.app)
+    resp = client.post("/risk", json={"amount": amount, "merchant": "any"})
+    assert resp.status_code == 200
+    assert resp.json() == {"risk_level": level}
+
+
+def test_mock_risk_rejects_invalid_body():
+    client = TestClient(mock_risk.app)
+    resp = client.post("/risk", json={"merchant": "any"})
+    assert resp.status_code == 422